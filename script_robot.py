@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
+import asyncio
 import socket
+import struct
 import time
 import json
 import pygame
@@ -8,6 +10,9 @@ import pygame
 # !!! CRITICAL: Replace with your Raspberry Pi's actual IP address !!!
 RPI_HOST = '192.168.1.18'
 RPI_PORT = 65432  # This must match the port number in your Raspberry Pi script
+# 'tcp' or 'udp'. UDP avoids head-of-line blocking and retransmit stalls, but the
+# Raspberry Pi script must then read datagrams and drop any whose "seq" is stale.
+RPI_PROTOCOL = 'tcp'
 
 # --- Controller Configuration ---
 JOYSTICK_DEAD_ZONE = 0.18 # Increase if your joystick drifts when centered
@@ -23,17 +28,45 @@ AXIS_RIGHT_TRIGGER = 5  # For acceleration: -1 (unpressed) to +1 (fully pressed)
 
 current_speed = 0.5  # Initial throttle (range 0.0 to 1.0)
 speed_step = 0.1     # Increment for speed change
+HEARTBEAT_INTERVAL = 0.5  # Resend an unchanged command at least this often (seconds)
+FRAME_INTERVAL = 1 / 30   # Time between input/send frames (seconds)
+DRAW_INTERVAL = 1 / 15    # The window is redrawn at half the input rate (seconds)
+SEND_TIMEOUT = 1.0        # A send stalled longer than this drops the connection (seconds)
+RECONNECT_DELAY_MIN = 0.1 # First reconnect attempt waits this long (seconds)...
+RECONNECT_DELAY_MAX = 5.0 # ...doubling after each failure up to this cap
 running = True
 
-def get_keyboard_inputs_from_pygame(keys, current_speed):
+# --- Movement Key Bitmask ---
+# Held movement keys are tracked as bits, updated from KEYDOWN/KEYUP events.
+KEY_W, KEY_A, KEY_S, KEY_D = 1, 2, 4, 8
+WASD_BITS = {pygame.K_w: KEY_W, pygame.K_a: KEY_A, pygame.K_s: KEY_S, pygame.K_d: KEY_D}
+
+# --- Wire Format ---
+# The Raspberry Pi script parses JSON objects, so the format stays JSON; the
+# encoder is built once here rather than going through json.dumps every frame.
+# Compact separators drop the whitespace, and ensure_ascii (the default) makes
+# the output plain ASCII.
+_encode_json = json.JSONEncoder(separators=(',', ':')).encode
+
+def encode_command(commands):
+    """Serializes a motor command dictionary into the bytes sent to the robot."""
+    return _encode_json(commands).encode('ascii')
+
+def with_sequence(message, seq):
+    """Adds a "seq" field to an encoded command, for the UDP transport."""
+    return b'{"seq":%d,' % seq + message[1:]
+
+STOP_CMD_BYTES = encode_command({ "active": False, "front_left": 0, "back_left": 0, "front_right": 0, "back_right": 0 })
+
+def tank_mix(keys_down):
     """
-    Processes keyboard inputs from pygame and returns a dictionary of motor commands.
+    Mixes a held movement keys bitmask into normalized (left, right) track power.
     """
     # Movement inputs
-    forward = keys[pygame.K_w]
-    backward = keys[pygame.K_s]
-    left = keys[pygame.K_a]
-    right = keys[pygame.K_d]
+    forward = keys_down & KEY_W
+    backward = keys_down & KEY_S
+    left = keys_down & KEY_A
+    right = keys_down & KEY_D
 
     # Determine direction
     y_input = 0
@@ -58,130 +91,312 @@ def get_keyboard_inputs_from_pygame(keys, current_speed):
         left_power_raw /= max_raw_power
         right_power_raw /= max_raw_power
 
-    # Apply current_speed scaling
-    left_final_power = left_power_raw * current_speed * MAX_MOTOR_POWER
-    right_final_power = right_power_raw * current_speed * MAX_MOTOR_POWER
+    return left_power_raw, right_power_raw
+
+# Only 16 WASD combinations exist, so the mix is precomputed for every bitmask
+TANK_MIX_TABLE = [tank_mix(keys_down) for keys_down in range(16)]
+
+def get_keyboard_inputs_from_pygame(keys_down, current_speed):
+    """
+    Processes the held movement keys bitmask and returns a dictionary of motor commands.
+    """
+    left_power_raw, right_power_raw = TANK_MIX_TABLE[keys_down]
+
+    # Apply current_speed scaling, converting each side to an int once
+    scale = current_speed * MAX_MOTOR_POWER
+    left_final_power = int(left_power_raw * scale)
+    right_final_power = int(right_power_raw * scale)
 
     # Create the command dictionary
     commands = {
-        "front_left": int(left_final_power),
-        "back_left": int(left_final_power),
-        "front_right": int(right_final_power),
-        "back_right": int(right_final_power),
+        "front_left": left_final_power,
+        "back_left": left_final_power,
+        "front_right": right_final_power,
+        "back_right": right_final_power,
         "active": True
     }
     return commands
 
-def run_network_client():
-    """Main function to run the network client and handle controller events."""
-    global running, current_speed
-    stop_command = json.dumps({ "active": False, "front_left": 0, "back_left": 0, "front_right": 0, "back_right": 0 })
-
-    pygame.init()
-    screen = pygame.display.set_mode((400, 300))
-    pygame.display.set_caption("Robot Controller")
-    font = pygame.font.SysFont(None, 24)
-    clock = pygame.time.Clock()
+def publish_command(queue, message):
+    """
+    Puts a command in the size-1 send queue, replacing one the sender hasn't picked up yet.
+    While a send is stalled the newest command keeps overwriting the pending one, so the
+    robot gets the current state once the socket drains instead of a backlog of stale ones.
+    """
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(message)
 
-    button_rect = pygame.Rect(150, 125, 100, 50)
-    is_sending = False
+async def send_commands(queue):
+    """Keeps a connection to the Raspberry Pi open and sends each command taken from the queue."""
+    global running
+    loop = asyncio.get_running_loop()
+    retry_delay = RECONNECT_DELAY_MIN
+    last_message = None # Resent first after a reconnect so the robot resumes right away
 
     while running:
         client_socket = None
+        connected = False
+        stream_intact = False # Whether every message written to the socket was written in full
         try:
             print(f"Attempting to connect to Raspberry Pi at {RPI_HOST}:{RPI_PORT}...")
             client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client_socket.settimeout(5.0) # Set a timeout for the connection attempt
-            client_socket.connect((RPI_HOST, RPI_PORT))
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) # Send each small command immediately (disable Nagle)
+            client_socket.setblocking(False)
+            await asyncio.wait_for(loop.sock_connect(client_socket, (RPI_HOST, RPI_PORT)), 5.0) # Time out the connection attempt
             print("Connection successful!")
-            
-            # Connection is active, loop until it breaks
-            while running:
-                for event in pygame.event.get():
-                    if event.type == pygame.QUIT:
-                        running = False
-                    elif event.type == pygame.MOUSEBUTTONDOWN:
-                        if event.button == 1:  # Left click
-                            if button_rect.collidepoint(event.pos):
-                                is_sending = not is_sending
-                    elif event.type == pygame.KEYDOWN:
-                        if event.key == pygame.K_UP:
-                            current_speed = min(1.0, current_speed + speed_step)
-                            print(f"Increased speed to {current_speed:.1f}")
-                        elif event.key == pygame.K_DOWN:
-                            current_speed = max(0.0, current_speed - speed_step)
-                            print(f"Decreased speed to {current_speed:.1f}")
-                        elif event.key == pygame.K_ESCAPE:
-                            print("Escape key pressed. Shutting down...")
-                            running = False
-                        elif event.key == pygame.K_SPACE:
-                            is_sending = False
-                            print("Space pressed. Stopping robot and stopping sending.")
-
-                keys = pygame.key.get_pressed()
-
-                if is_sending:
-                    commands = get_keyboard_inputs_from_pygame(keys, current_speed)
-                    message_to_send = json.dumps(commands)
-                else:
-                    commands = None
-                    message_to_send = stop_command
-
-                client_socket.sendall(message_to_send.encode('utf-8'))
-
-                # Drawing
-                screen.fill((30, 30, 30))
-
-                # Draw button
-                button_color = (0, 200, 0) if is_sending else (200, 0, 0)
-                pygame.draw.rect(screen, button_color, button_rect)
-                button_text = font.render("START" if not is_sending else "STOP", True, (255, 255, 255))
-                text_rect = button_text.get_rect(center=button_rect.center)
-                screen.blit(button_text, text_rect)
-
-                # Draw keys held with highlight
-                key_labels = ['W', 'A', 'S', 'D']
-                key_positions = [(180, 200), (140, 230), (180, 230), (220, 230)]
-                key_states = [keys[pygame.K_w], keys[pygame.K_a], keys[pygame.K_s], keys[pygame.K_d]]
-
-                for label, pos, pressed in zip(key_labels, key_positions, key_states):
-                    color = (0, 255, 0) if pressed else (180, 180, 180)
-                    key_surf = font.render(label, True, color)
-                    screen.blit(key_surf, pos)
-
-                # Display current command being sent
-                if commands:
-                    command_text = json.dumps(commands, indent=2)
-                else:
-                    command_text = json.dumps({ "active": False })
-
-                # Render multiline command text
-                lines = command_text.split('\n')
-                for i, line in enumerate(lines):
-                    cmd_surf = font.render(line, True, (255, 255, 255))
-                    screen.blit(cmd_surf, (10, 10 + i * 20))
+            retry_delay = RECONNECT_DELAY_MIN
+            connected = stream_intact = True
 
-                pygame.display.flip()
-                clock.tick(30)  # Limit to 30 FPS
+            # Connection is active, send until it breaks or stalls for too long
+            queue_get = queue.get
+            sock_sendall = loop.sock_sendall
+            # Start with the newest command: one still queued, otherwise the last one taken before the drop
+            if not queue.empty():
+                last_message = queue.get_nowait()
+            message = last_message
+            while running:
+                if message is None:
+                    message = await queue_get()
+                last_message = message
+                # A send cut short by the timeout may leave half a message on the stream
+                stream_intact = False
+                await asyncio.wait_for(sock_sendall(client_socket, message), SEND_TIMEOUT)
+                stream_intact = True
+                message = None
 
-        except (socket.timeout, ConnectionRefusedError, ConnectionResetError, BrokenPipeError) as e:
-            print(f"Network error: {e}. Will retry in 5 seconds...")
+        except (asyncio.TimeoutError, ConnectionRefusedError, ConnectionResetError, BrokenPipeError) as e:
+            print(f"Network error: {str(e) or 'connection timed out'}. Will retry in {retry_delay:.1f} seconds...")
         except Exception as e:
             print(f"An unexpected error occurred: {e}")
             running = False # Stop on other critical errors
         finally:
-            if client_socket:
+            if client_socket and stream_intact:
                 try:
-                    # Attempt to send a final stop command before closing the socket
-                    client_socket.sendall(stop_command.encode('utf-8'))
+                    # Attempt to send a final stop command before closing the socket, without blocking the UI
+                    await asyncio.wait_for(loop.sock_sendall(client_socket, STOP_CMD_BYTES), 1.0)
                     print("Sent final stop command.")
                 except Exception as final_e:
-                    print(f"Could not send final stop command: {final_e}")
+                    print(f"Could not send final stop command: {str(final_e) or 'timed out'}")
+            elif client_socket and connected:
+                # A message was cut off mid-stream, so a stop command would arrive glued to it and be
+                # unparseable. Reset the connection instead of flushing the partial message.
+                client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            if client_socket:
                 client_socket.close()
 
-            if running: # If we are not quitting, wait before retrying connection
-                time.sleep(5)
+        if running: # If we are not quitting, back off before retrying connection
+            await asyncio.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, RECONNECT_DELAY_MAX)
+
+async def send_datagrams(queue):
+    """
+    Sends each command taken from the queue to the Raspberry Pi as one UDP datagram.
+    There is no connection to lose, so a single socket is kept for the whole session.
+    """
+    global running
+    loop = asyncio.get_running_loop()
+    seq = 0
+    last_refused_log = None
+    client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client_socket.setblocking(False)
+    try:
+        await loop.sock_connect(client_socket, (RPI_HOST, RPI_PORT)) # Connected UDP: send() goes to the Pi
+        print(f"Sending commands to Raspberry Pi at {RPI_HOST}:{RPI_PORT} over UDP.")
+
+        queue_get = queue.get
+        sock_sendall = loop.sock_sendall
+        while running:
+            message = await queue_get()
+            # Each datagram carries a wrapping sequence number so reordered packets can be dropped
+            seq = (seq + 1) & 0xFF
+            datagram = with_sequence(message, seq)
+            try:
+                await sock_sendall(client_socket, datagram)
+            except ConnectionRefusedError:
+                # An ICMP port-unreachable for an earlier datagram fails this send instead, so retry it
+                # once; if the Pi still isn't listening, the next command or heartbeat tries again.
+                now = time.monotonic()
+                if last_refused_log is None or now - last_refused_log >= RECONNECT_DELAY_MAX:
+                    print("Raspberry Pi is not listening yet; still sending commands...")
+                    last_refused_log = now
+                try:
+                    await sock_sendall(client_socket, datagram)
+                except ConnectionRefusedError:
+                    pass
+
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        running = False # Stop on other critical errors
+    finally:
+        try:
+            # Attempt to send a final stop command before closing the socket, without blocking the UI
+            seq = (seq + 1) & 0xFF
+            await asyncio.wait_for(loop.sock_sendall(client_socket, with_sequence(STOP_CMD_BYTES, seq)), 1.0)
+            print("Sent final stop command.")
+        except Exception as final_e:
+            print(f"Could not send final stop command: {str(final_e) or 'timed out'}")
+        client_socket.close()
+
+async def run_network_client():
+    """Main coroutine: runs the pygame UI loop while a separate task handles the network connection."""
+    global running, current_speed
+
+    pygame.init()
+    screen = pygame.display.set_mode((400, 300))
+    pygame.display.set_caption("Robot Controller")
+    font = pygame.font.SysFont(None, 24)
+    pygame.event.set_blocked(pygame.MOUSEMOTION) # Mouse movement is unused; don't wake up for it
+
+    # Pre-render the static labels once instead of rasterizing them every frame
+    key_labels = ['W', 'A', 'S', 'D']
+    key_bits = [KEY_W, KEY_A, KEY_S, KEY_D]
+    key_positions = [(180, 200), (140, 230), (180, 230), (220, 230)]
+    label_cache = {}
+    for label in key_labels:
+        # convert_alpha() matches the display's pixel format so blits skip per-pixel conversion
+        label_cache[(label, True)] = font.render(label, True, (0, 255, 0)).convert_alpha()
+        label_cache[(label, False)] = font.render(label, True, (180, 180, 180)).convert_alpha()
+    key_rects = [label_cache[(label, False)].get_rect(topleft=pos) for label, pos in zip(key_labels, key_positions)]
+
+    # Static background, blitted to clear the regions that change
+    background = pygame.Surface(screen.get_size()).convert()
+    background.fill((30, 30, 30))
+
+    # Button color, label and label position for each sending state, keyed by is_sending
+    button_rect = pygame.Rect(150, 125, 100, 50)
+    button_styles = {}
+    for sending, label, color in ((False, "START", (200, 0, 0)), (True, "STOP", (0, 200, 0))):
+        button_text = font.render(label, True, (255, 255, 255)).convert_alpha()
+        button_styles[sending] = (color, button_text, button_text.get_rect(center=button_rect.center))
+    is_sending = False
+    keys_down = 0
+
+    # Only the newest command is kept, so a stalled connection never builds a backlog
+    send_queue = asyncio.Queue(maxsize=1)
+    sender = asyncio.create_task(send_datagrams(send_queue) if RPI_PROTOCOL == 'udp' else send_commands(send_queue))
+
+    last_sent = None
+    last_sent_time = 0.0
+    next_frame_time = time.monotonic()
+    next_draw_time = next_frame_time
+
+    # What is currently on screen; only regions whose state changed get redrawn
+    full_redraw = True
+    drawn_sending = None
+    drawn_keys = [None] * len(key_labels)
+    cmd_surf = None
+    cmd_surf_key = None
+    cmd_rect = pygame.Rect(10, 10, 0, 0)
+
+    # Bind the per-frame calls to locals to skip repeated attribute lookups in the loop
+    event_get = pygame.event.get
+    monotonic = time.monotonic
+    blit = screen.blit
+    render = font.render
+    update_display = pygame.display.update
+
+    while running:
+        # Drain everything pending in one batch
+        events = event_get()
+        for event in events:
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                if event.button == 1:  # Left click
+                    if button_rect.collidepoint(event.pos):
+                        is_sending = not is_sending
+            elif event.type == pygame.WINDOWEXPOSED:
+                full_redraw = True
+            elif event.type == pygame.KEYUP:
+                keys_down &= ~WASD_BITS.get(event.key, 0)
+            elif event.type == pygame.WINDOWFOCUSLOST:
+                keys_down = 0 # KEYUP events are not delivered while unfocused
+            elif event.type == pygame.KEYDOWN:
+                keys_down |= WASD_BITS.get(event.key, 0)
+                if event.key == pygame.K_UP:
+                    current_speed = min(1.0, current_speed + speed_step)
+                    print(f"Increased speed to {current_speed:.1f}")
+                elif event.key == pygame.K_DOWN:
+                    current_speed = max(0.0, current_speed - speed_step)
+                    print(f"Decreased speed to {current_speed:.1f}")
+                elif event.key == pygame.K_ESCAPE:
+                    print("Escape key pressed. Shutting down...")
+                    running = False
+                elif event.key == pygame.K_SPACE:
+                    is_sending = False
+                    print("Space pressed. Stopping robot and stopping sending.")
+
+        if is_sending:
+            commands = get_keyboard_inputs_from_pygame(keys_down, current_speed)
+            message_to_send = encode_command(commands)
+        else:
+            commands = None
+            message_to_send = STOP_CMD_BYTES
+
+        # Only send when the command changes, plus a periodic heartbeat
+        now = monotonic()
+        if message_to_send != last_sent or (now - last_sent_time) > HEARTBEAT_INTERVAL:
+            publish_command(send_queue, message_to_send)
+            last_sent = message_to_send
+            last_sent_time = now
+
+        # Input is handled and sent above before any drawing; the window itself is redrawn at a lower rate
+        if now >= next_draw_time:
+            # Advance from the previous deadline so frame jitter doesn't push drawing to every third frame
+            next_draw_time = max(next_draw_time + DRAW_INTERVAL, now)
+
+            # Drawing: redraw only the regions whose state changed since the last frame
+            dirty_rects = []
+            if full_redraw:
+                blit(background, (0, 0))
+                drawn_sending = None
+                drawn_keys = [None] * len(key_labels)
+
+            # Draw button
+            if is_sending != drawn_sending:
+                button_color, button_text, text_rect = button_styles[is_sending]
+                screen.fill(button_color, button_rect)
+                blit(button_text, text_rect)
+                dirty_rects.append(button_rect)
+                drawn_sending = is_sending
+
+            # Draw keys held with highlight
+            for i, (label, key_rect, bit) in enumerate(zip(key_labels, key_rects, key_bits)):
+                pressed = bool(keys_down & bit)
+                if pressed != drawn_keys[i]:
+                    blit(background, key_rect, key_rect)
+                    blit(label_cache[(label, pressed)], key_rect)
+                    dirty_rects.append(key_rect)
+                    drawn_keys[i] = pressed
+
+            # Display current command being sent, re-rendered only when it changes
+            if message_to_send != cmd_surf_key or full_redraw:
+                if message_to_send != cmd_surf_key:
+                    if commands:
+                        command_text = (f"FL {commands['front_left']}  BL {commands['back_left']}  "
+                                        f"FR {commands['front_right']}  BR {commands['back_right']}")
+                    else:
+                        command_text = "Inactive"
+                    cmd_surf = render(command_text, True, (255, 255, 255)).convert_alpha()
+                    cmd_surf_key = message_to_send
+                blit(background, cmd_rect, cmd_rect) # Clear the previous text
+                new_cmd_rect = blit(cmd_surf, (10, 10))
+                dirty_rects.append(cmd_rect.union(new_cmd_rect))
+                cmd_rect = new_cmd_rect
+
+            if full_redraw:
+                pygame.display.flip()
+                full_redraw = False
+            elif dirty_rects:
+                update_display(dirty_rects)
+
+        # Yield to the sender until the next frame deadline; the event loop sleeps in the OS meanwhile
+        next_frame_time = max(next_frame_time + FRAME_INTERVAL, monotonic())
+        await asyncio.sleep(next_frame_time - monotonic())
 
+    sender.cancel()
+    await asyncio.gather(sender, return_exceptions=True)
     pygame.quit()
     print("Client application shut down.")
 
@@ -189,4 +404,4 @@ if __name__ == '__main__':
     if RPI_HOST == 'YOUR_RASPBERRY_PI_IP_ADDRESS':
         print("!!! WARNING: You must edit this script to set the RPI_HOST variable !!!")
     else:
-        run_network_client()
\ No newline at end of file
+        asyncio.run(run_network_client())
\ No newline at end of file